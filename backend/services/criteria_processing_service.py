@@ -1,17 +1,96 @@
 import json
+import os
+import random
 import requests
 import time
 import re
 from typing import List, Dict
+from dotenv import load_dotenv
+
+# Load environment variables from .env file once, when the module is first imported
+load_dotenv()
+
+# Patterns to identify and remove sensitive information
+SENSITIVE_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE) for pattern in [
+        r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',  # Email addresses
+        r'\b\d{3}-\d{3}-\d{4}\b',  # Phone numbers
+        r'\b\d{3}\.\d{3}\.\d{4}\b',  # Phone numbers with dots
+        r'\([0-9]{3}\)\s*[0-9]{3}-[0-9]{4}',  # Phone numbers with parentheses
+        r'\b[A-Z][a-z]+ (?:Inc|LLC|Corp|Ltd|Company)\b',  # Company names
+        r'\bconfidential\b|\bproprietary\b|\binternal\b',  # Sensitive keywords
+    ]
+]
+
+# Generic replacements
+GENERIC_REPLACEMENTS = {
+    'our company': 'the organization',
+    'our client': 'the client',
+    'our team': 'the team',
+    'our product': 'the product',
+    'our system': 'the system',
+    'our platform': 'the platform',
+}
+GENERIC_REPLACEMENTS_RE = re.compile('|'.join(map(re.escape, GENERIC_REPLACEMENTS)), re.IGNORECASE)
+
+# Numbered or bulleted list item in a free-text criteria response
+CRITERIA_LINE_RE = re.compile(r'^[ \t]*(?:\d+\.|[-*•])[ \t]*"?(.*?)"?[ \t\r]*$', re.MULTILINE)
+
+# Fallback criteria used when the API cannot generate them
+GENERIC_FALLBACK_CRITERIA = [
+    "Technical implementation quality and code structure",
+    "Problem-solving approach and methodology",
+    "User interface design and user experience",
+    "Code documentation and clarity",
+    "Creative solution and innovation",
+    "Overall project presentation and completeness"
+]
+
+# Role-specific fallbacks, matched in order against keywords in the job title
+ROLE_FALLBACK_CRITERIA = [
+    (('developer', 'engineer'), GENERIC_FALLBACK_CRITERIA),
+    (('designer',), [
+        "Visual design quality and aesthetics",
+        "User experience and interface usability",
+        "Creative problem-solving approach",
+        "Design consistency and attention to detail",
+        "Presentation and communication of design decisions"
+    ]),
+    (('data', 'analyst'), [
+        "Data analysis accuracy and methodology",
+        "Visualization clarity and effectiveness",
+        "Problem-solving approach and insights",
+        "Documentation and explanation quality",
+        "Technical implementation and tools usage"
+    ]),
+]
+
+# Fixed instruction block for criteria generation, sent ahead of the per-posting job details.
+# At ~300 tokens it is below the 1024-token minimum for Anthropic prompt caching, so it
+# is not marked cacheable.
+CRITERIA_INSTRUCTIONS = """You are an expert HR professional tasked with creating evaluation criteria for job applicants. 
+
+Based on the job requirements and the example task provided below, generate 4-6 specific, measurable evaluation criteria that can be used to assess applicant submissions. Each criterion should be:
+
+1. SPECIFIC: Clear and unambiguous
+2. MEASURABLE: Can be objectively evaluated
+3. RELEVANT: Directly related to job requirements
+4. PROFESSIONAL: Use formal, standardized language
+
+IMPORTANT FILTERING REQUIREMENTS:
+- Remove any company names, proprietary information, or internal processes
+- Remove personal information, email addresses, phone numbers
+- Remove specific client names or confidential business details
+- Generalize any industry-specific jargon to be more universally applicable
+- Focus on skills, competencies, and deliverable quality rather than company-specific requirements
+
+Return your response as a JSON array of strings, with each string being one evaluation criterion.
+
+Example format:
+["Technical implementation quality and code structure", "User interface design and user experience", "Problem-solving approach and creativity", "Documentation quality and clarity"]"""
 
 class CriteriaProcessingService:
     def __init__(self):
-        import os
-        from dotenv import load_dotenv
-        
-        # Load environment variables from .env file
-        load_dotenv()
-        
         self.api_key = os.getenv('ANTHROPIC_API_KEY')
         if not self.api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable is required")
@@ -25,10 +104,10 @@ class CriteriaProcessingService:
         """
         try:
             # Create processing prompt
-            prompt = self._create_criteria_prompt(example_task, job_title, job_description)
+            content = self._create_criteria_prompt(example_task, job_title, job_description)
             
             # Make API call with retry logic
-            response = self._make_api_call_with_retry(prompt)
+            response = self._make_api_call_with_retry(content)
             
             # Parse and clean criteria
             criteria = self._parse_criteria_response(response)
@@ -43,41 +122,26 @@ class CriteriaProcessingService:
             # Fallback to basic criteria if API fails
             return self._fallback_criteria(job_title)
     
-    def _create_criteria_prompt(self, example_task: str, job_title: str, job_description: str) -> str:
+    def _create_criteria_prompt(self, example_task: str, job_title: str, job_description: str) -> List[Dict]:
         """
-        Create detailed prompt for criteria generation
+        Create detailed prompt for criteria generation: the fixed instructions,
+        then the job details
         """
-        return f"""You are an expert HR professional tasked with creating evaluation criteria for job applicants. 
-
-JOB TITLE: {job_title}
+        job_details = f"""JOB TITLE: {job_title}
 
 JOB DESCRIPTION: {job_description}
 
 EXAMPLE TASK PROVIDED BY EMPLOYER:
 {example_task}
 
-Based on the job requirements and the example task, generate 4-6 specific, measurable evaluation criteria that can be used to assess applicant submissions. Each criterion should be:
-
-1. SPECIFIC: Clear and unambiguous
-2. MEASURABLE: Can be objectively evaluated
-3. RELEVANT: Directly related to job requirements
-4. PROFESSIONAL: Use formal, standardized language
-
-IMPORTANT FILTERING REQUIREMENTS:
-- Remove any company names, proprietary information, or internal processes
-- Remove personal information, email addresses, phone numbers
-- Remove specific client names or confidential business details
-- Generalize any industry-specific jargon to be more universally applicable
-- Focus on skills, competencies, and deliverable quality rather than company-specific requirements
-
-Return your response as a JSON array of strings, with each string being one evaluation criterion.
-
-Example format:
-["Technical implementation quality and code structure", "User interface design and user experience", "Problem-solving approach and creativity", "Documentation quality and clarity"]
-
 Criteria:"""
+        
+        return [
+            {"type": "text", "text": CRITERIA_INSTRUCTIONS},
+            {"type": "text", "text": job_details}
+        ]
 
-    def _make_api_call_with_retry(self, prompt: str, max_retries: int = 3) -> Dict:
+    def _make_api_call_with_retry(self, content: List[Dict], max_retries: int = 3) -> Dict:
         """
         Make API call with retry logic
         """
@@ -90,7 +154,7 @@ Criteria:"""
         data = {
             "model": self.model,
             "max_tokens": 1000,
-            "messages": [{"role": "user", "content": prompt}]
+            "messages": [{"role": "user", "content": content}]
         }
         
         for attempt in range(max_retries):
@@ -101,10 +165,26 @@ Criteria:"""
             except requests.exceptions.RequestException as e:
                 print(f"API call attempt {attempt + 1} failed: {e}")
                 if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)  # Exponential backoff
+                    time.sleep(self._retry_delay(e, attempt))
                 else:
                     raise
     
+    def _retry_delay(self, error: requests.exceptions.RequestException, attempt: int) -> float:
+        """
+        Compute backoff delay, honoring the server's Retry-After header when present
+        """
+        response = getattr(error, 'response', None)
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return float(retry_after)
+                except ValueError:
+                    pass  # HTTP-date form, fall back to jittered backoff
+        
+        # Full jitter keeps concurrent workers from retrying in lock-step
+        return random.uniform(0, min(2 ** attempt, 30))
+    
     def _parse_criteria_response(self, response: Dict) -> List[str]:
         """
         Parse Claude's response into criteria list
@@ -135,19 +215,12 @@ Criteria:"""
         """
         Extract criteria from unstructured text response
         """
-        criteria = []
-        
-        # Look for numbered lists or bullet points
-        lines = text.split('\n')
-        for line in lines:
-            line = line.strip()
-            # Match numbered lists (1., 2., etc.) or bullet points (-, *, •)
-            if re.match(r'^[\d]+\.|\-|\*|•', line):
-                # Clean up the line by removing numbering/bullets and quotes
-                clean_line = re.sub(r'^[\d]+\.|\-|\*|•|"', '', line).strip()
-                clean_line = clean_line.strip('"').strip()
-                if len(clean_line) > 10 and len(clean_line) < 150:  # Reasonable length
-                    criteria.append(clean_line)
+        # Match numbered lists (1., 2., etc.) or bullet points (-, *, •) in a single pass,
+        # capturing the item text without its numbering/bullet and surrounding quotes
+        criteria = [
+            clean_line for clean_line in (m.group(1).strip() for m in CRITERIA_LINE_RE.finditer(text))
+            if len(clean_line) > 10 and len(clean_line) < 150  # Reasonable length
+        ]
         
         return criteria[:6] if criteria else []  # Limit to 6 criteria
     
@@ -157,39 +230,21 @@ Criteria:"""
         """
         filtered_criteria = []
         
-        # Patterns to identify and remove sensitive information
-        sensitive_patterns = [
-            r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',  # Email addresses
-            r'\b\d{3}-\d{3}-\d{4}\b',  # Phone numbers
-            r'\b\d{3}\.\d{3}\.\d{4}\b',  # Phone numbers with dots
-            r'\([0-9]{3}\)\s*[0-9]{3}-[0-9]{4}',  # Phone numbers with parentheses
-            r'\b[A-Z][a-z]+ (?:Inc|LLC|Corp|Ltd|Company)\b',  # Company names
-            r'\bconfidential\b|\bproprietary\b|\binternal\b',  # Sensitive keywords
-        ]
-        
-        # Generic replacements
-        generic_replacements = {
-            'our company': 'the organization',
-            'our client': 'the client',
-            'our team': 'the team',
-            'our product': 'the product',
-            'our system': 'the system',
-            'our platform': 'the platform',
-        }
-        
         for criterion in criteria:
             if not criterion or len(criterion.strip()) < 10:
                 continue
-                
-            filtered_criterion = criterion.lower()
+            
+            # Redact case-insensitively so acronyms like SQL or UI/UX keep their casing
+            filtered_criterion = criterion
             
             # Remove sensitive patterns
-            for pattern in sensitive_patterns:
-                filtered_criterion = re.sub(pattern, '[REDACTED]', filtered_criterion, flags=re.IGNORECASE)
+            for pattern in SENSITIVE_PATTERNS:
+                filtered_criterion = pattern.sub('[REDACTED]', filtered_criterion)
             
             # Apply generic replacements
-            for specific, generic in generic_replacements.items():
-                filtered_criterion = filtered_criterion.replace(specific, generic)
+            filtered_criterion = GENERIC_REPLACEMENTS_RE.sub(
+                lambda m: GENERIC_REPLACEMENTS[m.group(0).lower()], filtered_criterion
+            )
             
             # Skip if too much was redacted
             if '[REDACTED]' in filtered_criterion and filtered_criterion.count('[REDACTED]') > 2:
@@ -206,33 +261,10 @@ Criteria:"""
         """
         Fallback criteria if API processing fails
         """
-        generic_criteria = [
-            "Technical implementation quality and code structure",
-            "Problem-solving approach and methodology",
-            "User interface design and user experience",
-            "Code documentation and clarity",
-            "Creative solution and innovation",
-            "Overall project presentation and completeness"
-        ]
-        
         # Try to customize based on job title
-        if 'developer' in job_title.lower() or 'engineer' in job_title.lower():
-            return generic_criteria
-        elif 'designer' in job_title.lower():
-            return [
-                "Visual design quality and aesthetics",
-                "User experience and interface usability",
-                "Creative problem-solving approach",
-                "Design consistency and attention to detail",
-                "Presentation and communication of design decisions"
-            ]
-        elif 'data' in job_title.lower() or 'analyst' in job_title.lower():
-            return [
-                "Data analysis accuracy and methodology",
-                "Visualization clarity and effectiveness",
-                "Problem-solving approach and insights",
-                "Documentation and explanation quality",
-                "Technical implementation and tools usage"
-            ]
-        else:
-            return generic_criteria
\ No newline at end of file
+        title = job_title.lower()
+        for keywords, criteria in ROLE_FALLBACK_CRITERIA:
+            if any(keyword in title for keyword in keywords):
+                return list(criteria)
+        
+        return list(GENERIC_FALLBACK_CRITERIA)
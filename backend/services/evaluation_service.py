@@ -1,6 +1,36 @@
 import base64
+import functools
+import math
 import os
-from typing import List, Dict, Any, Optional
+import random
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+
+# Number of submission pairs judged per LLM call
+COMPARISON_BATCH_SIZE = 5
+
+# LLM calls in flight at once; kept low to stay under the API's per-minute rate limits
+MAX_CONCURRENT_COMPARISONS = 8
+
+# Above this many submissions, compare a sampled subset of pairs instead of every pair
+ROUND_ROBIN_LIMIT = 8
+
+# Pseudo-wins added to each compared pair when fitting Bradley-Terry strengths
+BRADLEY_TERRY_PRIOR = 0.1
+
+# When set (e.g. "https://hiring.example.com/api/frames"), frames are sent to Claude as
+# URLs under this base, served by the /api/frames endpoint, instead of inline base64
+FRAME_BASE_URL_ENV = 'FRAME_PUBLIC_BASE_URL'
+
+@functools.lru_cache(maxsize=256)
+def _encode_frame(path: str, mtime_ns: int, size: int) -> str:
+    """
+    Base64-encode a frame file. The modification time and size are part of the
+    cache key because re-extracting a video rewrites frames under the same names.
+    """
+    with open(path, 'rb') as f:
+        return base64.b64encode(f.read()).decode('utf-8')
 
 class EvaluationService:
     def __init__(self):
@@ -46,24 +76,42 @@ class EvaluationService:
         
         # Create a copy to avoid modifying original
         remaining = submissions.copy()
-        ranked = []
         
-        # Build win matrix to track head-to-head results
-        win_matrix = {}
-        for sub in submissions:
-            win_matrix[sub['id']] = {'wins': 0, 'total_comparisons': 0}
+        # Track head-to-head results in a contiguous matrix indexed by position in remaining:
+        # head_to_head[i, j] counts wins of submission i over submission j
+        head_to_head = np.zeros((len(remaining), len(remaining)), dtype=np.int32)
+        
+        # Small fields get a full round-robin; larger ones only a sampled subset of pairs,
+        # with the ranking recovered statistically. Several pairs are batched into each LLM call.
+        sampled = len(remaining) > ROUND_ROBIN_LIMIT
+        if sampled:
+            pairs = self._sample_pairs(remaining)
+        else:
+            pairs = [(i, j) for i in range(len(remaining)) for j in range(i + 1, len(remaining))]
+        
+        batches = [pairs[start:start + COMPARISON_BATCH_SIZE] for start in range(0, len(pairs), COMPARISON_BATCH_SIZE)]
+        
+        def compare_batch(batch, first, last):
+            if self.progress_callback:
+                matchups = ", ".join(f"{remaining[i]['applicant_name']} vs {remaining[j]['applicant_name']}" for i, j in batch)
+                self.progress_callback(f"Comparing {matchups} (Comparisons {first}-{last})")
+            return self._compare_group(remaining, batch, task_desc, criteria, llm_service)
         
-        # Perform round-robin comparisons to build reliable rankings
-        for i in range(len(remaining)):
-            for j in range(i + 1, len(remaining)):
+        # The LLM calls are independent, so run several at once and apply the
+        # results in batch order to keep feedback assignment deterministic
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_COMPARISONS) as executor:
+            futures = []
+            for batch in batches:
+                first = self.comparison_count + 1
+                self.comparison_count += len(batch)
+                futures.append(executor.submit(compare_batch, batch, first, self.comparison_count))
+            results = [future.result() for future in futures]
+        
+        for batch, comparisons in zip(batches, results):
+            for i, j in batch:
                 sub_a = remaining[i]
                 sub_b = remaining[j]
-                
-                self.comparison_count += 1
-                if self.progress_callback:
-                    self.progress_callback(f"Comparing {sub_a['applicant_name']} vs {sub_b['applicant_name']} (Comparison {self.comparison_count})")
-                
-                comparison = self._compare_submissions(sub_a, sub_b, task_desc, criteria, llm_service)
+                comparison = comparisons[(i, j)]
                 
                 # Store feedback for both submissions (only if not already set)
                 if 'feedback' not in sub_a or sub_a['feedback'] is None:
@@ -75,31 +123,113 @@ class EvaluationService:
                 
                 # Update win matrix
                 if comparison['winner'] == 'A':
-                    win_matrix[sub_a['id']]['wins'] += 1
+                    head_to_head[i, j] += 1
                 else:
-                    win_matrix[sub_b['id']]['wins'] += 1
-                
-                win_matrix[sub_a['id']]['total_comparisons'] += 1
-                win_matrix[sub_b['id']]['total_comparisons'] += 1
-        
-        # Calculate win rates and sort by them
-        for sub in remaining:
-            total_comps = win_matrix[sub['id']]['total_comparisons']
-            if total_comps > 0:
-                win_rate = win_matrix[sub['id']]['wins'] / total_comps
+                    head_to_head[j, i] += 1
+        
+        if sampled:
+            scores = self._bradley_terry_strengths(head_to_head)
+        else:
+            # Calculate win rates, leaving submissions without comparisons at 0.0
+            wins = head_to_head.sum(axis=1)
+            total_comparisons = (head_to_head + head_to_head.T).sum(axis=1)
+            scores = np.divide(wins, total_comparisons, out=np.zeros(len(remaining)),
+                               where=total_comparisons > 0)
+        
+        # Sort by score (highest first), keeping original order for ties
+        order = np.argsort(-scores, kind='stable')
+        return [remaining[idx] for idx in order]
+    
+    def _sample_pairs(self, submissions: List[Dict]) -> List[Tuple[int, int]]:
+        """
+        Sample about n*log2(n) distinct pairs for ranking a large field.
+        A random cycle through all submissions keeps the comparison graph connected,
+        so every submission gets compared (and receives feedback) at least twice.
+        """
+        n = len(submissions)
+        target = min(math.ceil(n * math.log2(n)), n * (n - 1) // 2)
+        
+        # Seed from the submission ids so re-running an evaluation compares the same pairs
+        rng = random.Random("|".join(sorted(str(sub['id']) for sub in submissions)))
+        
+        cycle = list(range(n))
+        rng.shuffle(cycle)
+        pairs = {tuple(sorted((cycle[k], cycle[(k + 1) % n]))) for k in range(n)}
+        
+        while len(pairs) < target:
+            i, j = rng.sample(range(n), 2)
+            pairs.add((min(i, j), max(i, j)))
+        
+        return sorted(pairs)
+    
+    def _bradley_terry_strengths(self, head_to_head: np.ndarray, max_iterations: int = 1000,
+                                 tolerance: float = 1e-8) -> np.ndarray:
+        """
+        Fit Bradley-Terry strengths to a head-to-head win matrix using the
+        minorization-maximization update p_i = W_i / sum_j N_ij / (p_i + p_j)
+        """
+        # A small pseudo-win in both directions of every compared pair keeps
+        # winless submissions at a finite, comparable strength
+        compared = (head_to_head + head_to_head.T) > 0
+        wins = head_to_head + BRADLEY_TERRY_PRIOR * compared
+        games = wins + wins.T
+        total_wins = wins.sum(axis=1)
+        
+        strengths = np.full(len(wins), 1.0 / len(wins))
+        for _ in range(max_iterations):
+            denominators = (games / (strengths[:, None] + strengths[None, :])).sum(axis=1)
+            updated = np.divide(total_wins, denominators, out=np.zeros_like(strengths),
+                                where=denominators > 0)
+            updated /= updated.sum()
+            
+            converged = np.max(np.abs(updated - strengths)) < tolerance
+            strengths = updated
+            if converged:
+                break
+        
+        return strengths
+    
+    def _compare_group(self, submissions: List[Dict], pairs: List[Tuple[int, int]], task_desc: str,
+                       criteria: List[str], llm_service) -> Dict[Tuple[int, int], Dict]:
+        """
+        Compare several pairs of submissions using a single LLM call
+        """
+        results = {}
+        pending = []
+        for i, j in pairs:
+            key = f"{submissions[i]['id']}_{submissions[j]['id']}"
+            if key in self.comparison_cache:
+                results[(i, j)] = self.comparison_cache[key]
             else:
-                win_rate = 0.0
-            sub['_win_rate'] = win_rate
+                pending.append((i, j))
         
-        # Sort by win rate (highest first)
-        ranked = sorted(remaining, key=lambda x: x['_win_rate'], reverse=True)
+        if len(pending) == 1:
+            i, j = pending[0]
+            results[(i, j)] = self._compare_submissions(submissions[i], submissions[j], task_desc, criteria, llm_service)
+            return results
         
-        # Clean up temporary win rate field
-        for sub in ranked:
-            if '_win_rate' in sub:
-                del sub['_win_rate']
+        if pending:
+            # Send each involved submission's frames once, indexed by position in the group
+            members = sorted({idx for pair in pending for idx in pair})
+            position = {idx: pos for pos, idx in enumerate(members)}
+            
+            group_results = llm_service.evaluate_group(
+                [self._encode_frames(submissions[idx]['key_frames'][:3]) for idx in members],
+                [submissions[idx]['applicant_name'] for idx in members],
+                [(position[i], position[j]) for i, j in pending],
+                task_desc, criteria
+            )
+            
+            for i, j in pending:
+                result = group_results.get((position[i], position[j]))
+                if result is None:
+                    # Claude skipped this pair, fall back to a dedicated comparison
+                    result = self._compare_submissions(submissions[i], submissions[j], task_desc, criteria, llm_service)
+                else:
+                    self.comparison_cache[f"{submissions[i]['id']}_{submissions[j]['id']}"] = result
+                results[(i, j)] = result
         
-        return ranked
+        return results
     
     def _compare_submissions(self, sub_a: Dict, sub_b: Dict, task_desc: str, 
                            criteria: List[str], llm_service) -> Dict:
@@ -126,11 +256,22 @@ class EvaluationService:
     
     def _encode_frames(self, frame_paths: List[str]) -> List[str]:
         """
-        Encode frames as base64 for LLM processing
+        Encode frames for LLM processing: as public URLs when a frame base URL is
+        configured, otherwise as base64, reusing the encoding of frames already
+        sent in earlier comparisons
         """
+        base_url = os.getenv(FRAME_BASE_URL_ENV, '').rstrip('/')
         encoded = []
         for path in frame_paths:
-            if os.path.exists(path):
-                with open(path, 'rb') as f:
-                    encoded.append(base64.b64encode(f.read()).decode('utf-8'))
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # Missing frames are skipped
+            if base_url:
+                # Frames live at <frames folder>/<submission id>/<file>; the version
+                # parameter changes when a video is re-extracted under the same names
+                submission_dir = os.path.basename(os.path.dirname(path))
+                encoded.append(f"{base_url}/{submission_dir}/{os.path.basename(path)}?v={stat.st_mtime_ns}")
+            else:
+                encoded.append(_encode_frame(path, stat.st_mtime_ns, stat.st_size))
         return encoded
@@ -1,50 +1,472 @@
+import av
+import bisect
 import cv2
 import numpy as np
 import os
+import queue
 import shutil
-from typing import List, Dict, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
+
+# Errors raised by PyAV for missing, unsupported or corrupt videos
+DECODE_ERRORS = (av.error.FFmpegError, OSError, IndexError)
+
+# Frames whose perceptual hashes differ by fewer bits than this are treated as duplicates.
+# The low-frequency hash rates quite different UI screens (an empty vs a filled-in form,
+# two pages of text) only a few bits apart, so the threshold is low and deduplication
+# always keeps at least MIN_KEPT_FRAMES frames for before/after comparisons.
+MIN_FRAME_HASH_DISTANCE = 3
+MIN_KEPT_FRAMES = 4
+
+# Saved frames are sized and compressed for LLM vision input; 1024px on the long
+# edge keeps UI text legible while cutting upload bytes and image-token cost
+MAX_FRAME_DIMENSION = 1024
+JPEG_QUALITY = 75
+
+# Threads encoding and writing the selected frames
+JPEG_WRITE_WORKERS = 4
+
+# Number of evenly spaced frames decoded and scored when choosing key frames
+CANDIDATE_FRAMES = 128
+
+# Frames on each side of a selected candidate that may replace it if they score higher
+REFINE_RADIUS = 3
+
+# Candidates are scored on thumbnails that fit within this (width, height)
+THUMBNAIL_SIZE = (480, 270)
+
+# Capacity of the queues between the decode, scoring and write stages
+PIPELINE_QUEUE_SIZE = 8
+
+# Threads scoring frames in parallel; OpenCV releases the GIL while it works
+SCORING_WORKERS = os.cpu_count() or 1
+
+# Run the per-pixel color work on the GPU through OpenCL (cv2.UMat) when available
+USE_OPENCL = cv2.ocl.haveOpenCL()
 
 def extract_key_frames(video_path: str, output_folder: str, num_frames: int = 8) -> List[str]:
     """
     Extract key frames from video with improved interactivity detection
     Returns list of saved frame paths (8 final frames)
+    
+    Frames are streamed rather than buffered: only an evenly spaced pool of
+    candidates is decoded for scoring, as thumbnails, and only the selected
+    frames (plus a few neighbours each, for long videos) are decoded again at
+    full resolution for saving. Decoding runs on a reader thread and JPEG
+    writing on a small pool of writer threads, connected to the scoring work
+    by bounded queues.
     """
     # Clean up old frames first
     if os.path.exists(output_folder):
         shutil.rmtree(output_folder)
     os.makedirs(output_folder, exist_ok=True)
     
-    cap = cv2.VideoCapture(video_path)
-    frames = []
-    frame_paths = []
+    total_frames = _count_frames(video_path)
     
-    # Read all frames
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frames.append(frame)
-    
-    cap.release()
-    
-    if len(frames) <= 9:
+    if total_frames <= 9:
         # If video has 9 or fewer frames, save all except first
-        for i, frame in enumerate(frames[1:]):  # Skip first frame
-            path = os.path.join(output_folder, f'frame_{i:04d}.jpg')
-            cv2.imwrite(path, frame)
-            frame_paths.append(path)
+        selected_indices = range(1, total_frames)
     else:
+        # Score an evenly spaced candidate pool, skipping the first frame (often black/loading)
+        candidate_indices = np.unique(
+            np.linspace(1, total_frames - 1, min(CANDIDATE_FRAMES, total_frames - 1)).astype(int)
+        )
+        read_indices, scores = _score_candidates(video_path, candidate_indices)
+        
         # Use intelligent frame selection for better interactivity detection
-        selected_frames = _select_interactive_frames(frames, num_frames)
+        selected_indices = read_indices[_select_indices_by_score(scores, num_frames)]
+    
+    if total_frames - 1 > CANDIDATE_FRAMES:
+        # Candidates were sampled, so a better frame may sit right next to a winner
+        frames = _refine_selection(video_path, selected_indices, total_frames)
+    else:
+        frames = (frame for _, frame in _prefetch(_read_frames(video_path, selected_indices)))
+    
+    # Drop near-duplicate frames so the LLM doesn't pay for the same screen twice
+    return _save_frames(_dedupe_frames(frames), output_folder)
+
+def _refine_selection(video_path: str, indices, total_frames: int,
+                      radius: int = REFINE_RADIUS) -> Iterator[np.ndarray]:
+    """
+    Decode a small window of frames around each selected frame and yield the
+    window's highest-scoring frame in its place. Windows are handled one at a
+    time in temporal order, so only one window of full-size frames is held.
+    Each window is reached by seeking, not by decoding the video from the start.
+    """
+    windows = []
+    for idx in sorted(int(i) for i in indices):
+        # Clip each window so it never overlaps the previous one
+        low = max(1, idx - radius, windows[-1][1] + 1 if windows else 1)
+        high = min(total_frames - 1, idx + radius)
+        windows.append((low, high, idx))
+    
+    window = 0
+    current = []
+    for idx, frame in _prefetch(_read_windows(video_path, [(low, high) for low, high, _ in windows])):
+        while idx > windows[window][1]:
+            if current:
+                yield _best_in_window(current, windows[window][2])
+                current = []
+            window += 1
+        current.append((idx, frame))
+    if current:
+        yield _best_in_window(current, windows[window][2])
+
+def _best_in_window(window: List[Tuple[int, np.ndarray]], center: int) -> np.ndarray:
+    """
+    Return the frame of a window with the highest content score, preferring the
+    originally selected frame on ties
+    """
+    thumb_size, area_scale = _thumbnail_geometry(window[0][1])
+    best_frame, best_score = None, -np.inf
+    for idx, frame in sorted(window, key=lambda item: item[0] != center):
+        thumb = cv2.resize(frame, thumb_size, interpolation=cv2.INTER_AREA)
+        score = _calculate_interactivity_score(thumb, area_scale)
+        if score > best_score:
+            best_frame, best_score = frame, score
+    return best_frame
+
+def _count_frames(video_path: str) -> int:
+    """
+    Count video frames without decoding them: PyAV counts demuxed packets,
+    falling back to OpenCV grab-only calls for containers it can't open.
+    CAP_PROP_FRAME_COUNT comes from container metadata and is often inaccurate.
+    """
+    try:
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            return sum(1 for packet in container.demux(stream) if packet.size)
+    except DECODE_ERRORS:
+        pass
+    
+    cap = cv2.VideoCapture(video_path)
+    count = 0
+    while cap.grab():
+        count += 1
+    cap.release()
+    return count
+
+def _read_frames(video_path: str, indices) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Stream (index, BGR frame) pairs for the given ascending frame indices in a
+    single sequential pass. Decoding uses PyAV with multi-threaded decode; frames
+    it cannot decode are read with OpenCV instead.
+    """
+    wanted = set(int(i) for i in indices)
+    if not wanted:
+        return
+    
+    try:
+        for idx, frame in _read_frames_av(video_path, wanted):
+            wanted.discard(idx)
+            yield idx, frame
+        return
+    except DECODE_ERRORS as e:
+        print(f"PyAV decoding failed for {video_path}, falling back to OpenCV: {e}")
+    
+    yield from _read_frames_cv2(video_path, wanted)
+
+def _read_frames_av(video_path: str, wanted: set) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Decode with PyAV, converting only the wanted frames to numpy arrays
+    """
+    last = max(wanted)
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = 'AUTO'
+        stream.thread_count = os.cpu_count() or 0
+        
+        for idx, frame in enumerate(container.decode(stream)):
+            if idx > last:
+                break
+            if idx in wanted:
+                yield idx, frame.to_ndarray(format='bgr24')
+
+def _read_windows(video_path: str, windows: List[Tuple[int, int]]) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Stream (index, BGR frame) pairs for ascending, non-overlapping inclusive
+    (low, high) index windows. PyAV seeks to the keyframe before each window and
+    decodes forward from there; if seeking fails, the remaining frames are read
+    in one sequential pass with _read_frames.
+    """
+    wanted = set(i for low, high in windows for i in range(low, high + 1))
+    last_yielded = -1
+    
+    try:
+        for idx, frame in _read_windows_av(video_path, windows):
+            wanted.discard(idx)
+            last_yielded = idx
+            yield idx, frame
+        return
+    except DECODE_ERRORS + (ValueError,) as e:
+        print(f"PyAV seeking failed for {video_path}, decoding sequentially: {e}")
+    
+    # Keep the output in ascending order for the caller
+    yield from _read_frames(video_path, sorted(i for i in wanted if i > last_yielded))
+
+def _read_windows_av(video_path: str, windows: List[Tuple[int, int]]) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Decode frame windows with PyAV, seeking only when the next window starts
+    past the next keyframe. Frames are matched to indices by presentation
+    timestamp, which keeps seeking frame-accurate. Raises ValueError if the
+    timestamps can't be used or a window isn't found.
+    """
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = 'AUTO'
+        stream.thread_count = os.cpu_count() or 0
+        
+        # Frame index -> timestamp and keyframe flags, from the packets alone (no decoding).
+        # Frames are indexed in presentation order, as _count_frames and _read_frames do.
+        packets = [(packet.pts, packet.is_keyframe) for packet in container.demux(stream) if packet.size]
+        if any(pts is None for pts, _ in packets):
+            raise ValueError("packets without timestamps")
+        packets.sort()
+        frame_pts = [pts for pts, _ in packets]
+        index_of = {pts: idx for idx, pts in enumerate(frame_pts)}
+        keyframes = [idx for idx, (_, keyframe) in enumerate(packets) if keyframe]
+        
+        position = len(frame_pts)  # Forces a seek before the first window
+        frames = iter(())
+        for low, high in windows:
+            if high >= len(frame_pts):
+                raise ValueError(f"frame {high} is past the end of the video")
+            
+            # Decoding forward is cheaper than seeking unless a keyframe lies ahead of us
+            preceding = bisect.bisect_right(keyframes, low)
+            keyframe = keyframes[preceding - 1] if preceding else 0
+            if position >= low or position < keyframe:
+                container.seek(frame_pts[low], backward=True, any_frame=False, stream=stream)
+                frames = container.decode(stream)
+            
+            found = 0
+            for frame in frames:
+                idx = index_of.get(frame.pts)
+                if idx is None:
+                    continue
+                position = idx
+                if low <= idx <= high:
+                    found += 1
+                    yield idx, frame.to_ndarray(format='bgr24')
+                if idx >= high:
+                    break
+            
+            if found != high - low + 1:
+                raise ValueError(f"frames {low}-{high} not found after seeking")
+
+def _read_frames_cv2(video_path: str, wanted: set) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Read with OpenCV, using grab() to skip frames and retrieve() only the wanted ones
+    """
+    if not wanted:
+        return
+    last = max(wanted)
+    
+    cap = cv2.VideoCapture(video_path)
+    try:
+        idx = 0
+        while idx <= last and cap.grab():
+            if idx in wanted:
+                ret, frame = cap.retrieve()
+                if ret:
+                    yield idx, frame
+            idx += 1
+    finally:
+        cap.release()
+
+def _prefetch(iterable: Iterable, maxsize: int = PIPELINE_QUEUE_SIZE) -> Iterator:
+    """
+    Run an iterator on a background thread, handing items to the caller through
+    a bounded queue so producing the next item overlaps with consuming this one.
+    Exceptions raised by the iterator are re-raised in the caller.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    done = object()
+    
+    def put(item) -> bool:
+        # Poll so the producer can exit if the consumer stops early
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def producer():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put(item):
+                    break
+        except BaseException as e:
+            put(_PipelineError(e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+            put(done)
+    
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            if isinstance(item, _PipelineError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+class _PipelineError:
+    """Wraps an exception raised on a pipeline thread"""
+    def __init__(self, error: BaseException):
+        self.error = error
+
+def _score_candidates(video_path: str, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decode the given frames into a preallocated stack of thumbnails and score them.
+    Each thumbnail is scored on a worker thread as soon as its frame is decoded,
+    so scoring overlaps with decoding. Returns the frame indices actually read
+    and their scores.
+    """
+    thumbnails = None
+    area_scale = 1.0
+    read_indices = []
+    scores = np.zeros(len(indices))
+    
+    def score_thumbnail(slot):
+        # Each task only touches its own slot of the preallocated stacks
+        cv2.cvtColor(thumbnails[slot], cv2.COLOR_BGR2GRAY, dst=grays[slot])
+        cv2.Canny(grays[slot], 50, 150, edges=edges[slot])
+        scores[slot] = _calculate_detail_score(thumbnails[slot], grays[slot], edges[slot], area_scale)
+    
+    with ThreadPoolExecutor(max_workers=SCORING_WORKERS) as executor:
+        futures = []
+        for idx, frame in _prefetch(_read_frames(video_path, indices)):
+            count = len(read_indices)
+            if thumbnails is None:
+                thumb_size, area_scale = _thumbnail_geometry(frame)
+                thumbnails = np.empty((len(indices), thumb_size[1], thumb_size[0], 3), dtype=np.uint8)
+                grays = np.empty((len(indices), thumb_size[1], thumb_size[0]), dtype=np.uint8)
+                edges = np.empty_like(grays)
+            
+            # Downscale here so full-size frames are not held by queued tasks
+            cv2.resize(frame, thumb_size, dst=thumbnails[count], interpolation=cv2.INTER_AREA)
+            read_indices.append(idx)
+            futures.append(executor.submit(score_thumbnail, count))
         
-        # Save selected frames
-        for idx, frame in enumerate(selected_frames):
+        for future in futures:
+            future.result()
+    
+    count = len(read_indices)
+    if count == 0:
+        return np.array(read_indices, dtype=int), scores[:0]
+    
+    # Whole-image statistics and frame differences (activity level) are computed
+    # over the full stack once decoding is done
+    scores = scores[:count] + _calculate_stack_scores(grays[:count], edges[:count])
+    scores += _calculate_frame_differences(grays[:count]) * 1.0
+    
+    return np.array(read_indices, dtype=int), scores
+
+def _thumbnail_geometry(frame: np.ndarray) -> Tuple[Tuple[int, int], float]:
+    """
+    Return the (width, height) a frame is scored at, fitting within THUMBNAIL_SIZE
+    with its aspect ratio kept, and the factor by which that shrinks its area.
+    Pixel-count thresholds in the detectors are multiplied by the area factor.
+    """
+    height, width = frame.shape[:2]
+    scale = min(THUMBNAIL_SIZE[0] / width, THUMBNAIL_SIZE[1] / height, 1.0)
+    thumb_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    area_scale = (thumb_size[0] * thumb_size[1]) / (width * height)
+    return thumb_size, area_scale
+
+def _save_frames(frames: Iterable[np.ndarray], output_folder: str) -> List[str]:
+    """
+    Save frames as numbered JPEGs, encoding them in parallel on a small thread
+    pool while the caller keeps producing frames. At most PIPELINE_QUEUE_SIZE
+    frames wait to be written at any time.
+    """
+    slots = threading.BoundedSemaphore(PIPELINE_QUEUE_SIZE)
+    frame_paths = []
+    futures = []
+    
+    with ThreadPoolExecutor(max_workers=JPEG_WRITE_WORKERS) as executor:
+        for idx, frame in enumerate(frames):
             path = os.path.join(output_folder, f'frame_{idx:04d}.jpg')
-            cv2.imwrite(path, frame)
+            slots.acquire()
+            future = executor.submit(_save_frame, path, frame)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
             frame_paths.append(path)
     
+    # Re-raise the first write error, if any
+    for future in futures:
+        future.result()
     return frame_paths
 
+def _save_frame(path: str, frame: np.ndarray) -> None:
+    """
+    Save a frame as a compact JPEG, downscaling it so the long edge never exceeds
+    what the vision model keeps after its own resize
+    """
+    height, width = frame.shape[:2]
+    scale = MAX_FRAME_DIMENSION / max(height, width)
+    if scale < 1:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    
+    # Encode in memory (OpenCV releases the GIL), then write the bytes in one call
+    ok, buffer = cv2.imencode('.jpg', np.ascontiguousarray(frame),
+                              [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY, cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    if not ok:
+        raise ValueError(f"Could not encode frame for {path}")
+    with open(path, 'wb') as f:
+        f.write(buffer.tobytes())
+
+def _dedupe_frames(frames: Iterable[np.ndarray], min_distance: int = MIN_FRAME_HASH_DISTANCE,
+                   min_frames: int = MIN_KEPT_FRAMES) -> List[np.ndarray]:
+    """
+    Greedily keep frames whose perceptual hash differs from every kept frame
+    by at least min_distance bits, preserving temporal order. If fewer than
+    min_frames survive, the rejected frames farthest from the kept ones are
+    added back one at a time.
+    """
+    frames = list(frames)
+    hashes = [_perceptual_hash(frame) for frame in frames]
+    kept = []
+    
+    def distance_to_kept(idx: int) -> int:
+        return min((np.count_nonzero(hashes[idx] != hashes[k]) for k in kept), default=hashes[idx].size)
+    
+    for idx in range(len(frames)):
+        if distance_to_kept(idx) >= min_distance:
+            kept.append(idx)
+    
+    rejected = [idx for idx in range(len(frames)) if idx not in kept]
+    while len(kept) < min(len(frames), min_frames):
+        best = max(rejected, key=distance_to_kept)
+        rejected.remove(best)
+        kept.append(best)
+    
+    return [frames[idx] for idx in sorted(kept)]
+
+def _perceptual_hash(frame: np.ndarray) -> np.ndarray:
+    """
+    Compute a 64-bit DCT perceptual hash (pHash) as a boolean array
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    
+    # Keep the 8x8 lowest frequencies, which capture the overall layout of the screen
+    low_freq = cv2.dct(small)[:8, :8]
+    return (low_freq > np.median(low_freq)).flatten()
+
 def _select_interactive_frames(frames: List[np.ndarray], num_frames: int = 8) -> List[np.ndarray]:
     """
     Intelligently select frames that are most likely to show interactivity
@@ -55,112 +477,169 @@ def _select_interactive_frames(frames: List[np.ndarray], num_frames: int = 8) ->
     # Skip first frame (often black/loading)
     frames = frames[1:]
     
-    # Calculate frame differences to detect activity/changes
-    frame_scores = []
-    for i in range(len(frames)):
-        score = _calculate_interactivity_score(frames[i], i, frames)
-        frame_scores.append((score, i, frames[i]))
+    # Score downscaled copies held in one preallocated stack; selection works on
+    # positions only, and the full-size frames are looked up for the winners
+    thumb_size, area_scale = _thumbnail_geometry(frames[0])
+    thumbs = np.empty((len(frames), thumb_size[1], thumb_size[0], 3), dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        cv2.resize(frame, thumb_size, dst=thumbs[i], interpolation=cv2.INTER_AREA)
     
-    # Sort by interactivity score (highest first)
-    frame_scores.sort(key=lambda x: x[0], reverse=True)
-    
-    # Select top frames, but ensure temporal distribution
+    return [frames[idx] for idx in _select_interactive_indices(thumbs, num_frames, area_scale)]
+
+def _select_interactive_indices(frames, num_frames: int = 8, area_scale: float = 1.0) -> List[int]:
+    """
+    Select the positions of the frames most likely to show interactivity,
+    in temporal order
+    """
+    if len(frames) <= num_frames:
+        return list(range(len(frames)))
+    
+    # Score each frame's content, plus frame differences to detect activity/changes
+    grays = np.empty((len(frames),) + frames[0].shape[:2], dtype=np.uint8)
+    edges = np.empty_like(grays)
+    for i, frame in enumerate(frames):
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=grays[i])
+        cv2.Canny(grays[i], 50, 150, edges=edges[i])
+    with ThreadPoolExecutor(max_workers=SCORING_WORKERS) as executor:
+        scores = np.array(list(executor.map(
+            lambda i: _calculate_detail_score(frames[i], grays[i], edges[i], area_scale),
+            range(len(frames)))))
+    scores += _calculate_stack_scores(grays, edges)
+    scores += _calculate_frame_differences(grays) * 1.0
+    
+    return _select_indices_by_score(scores, num_frames)
+
+def _select_indices_by_score(scores, num_frames: int = 8) -> List[int]:
+    """
+    Pick the highest-scoring positions while keeping them spread out in time,
+    returned in temporal order
+    """
+    scores = np.asarray(scores)
+    total = len(scores)
+    if total <= num_frames:
+        return list(range(total))
+    
+    # Only the best few times num_frames positions can realistically win, so
+    # partition those off instead of sorting everything. Ties with the cutoff
+    # score are kept so the order matches a full stable sort.
+    pool_size = min(num_frames * 4, total)
+    cutoff = -np.partition(-scores, pool_size - 1)[pool_size - 1]
+    top = np.flatnonzero(scores >= cutoff)
+    rest = np.flatnonzero(scores < cutoff)
+    
+    # Select top frames (highest score first, earlier frame on ties), but ensure
+    # temporal distribution: each pick blocks the positions too close to it
+    gap = total // (num_frames * 2)
+    blocked = np.zeros(total, dtype=bool)
     selected_indices = []
-    selected_frames = []
-    
-    # First, take the highest scoring frames
-    for score, idx, frame in frame_scores:
+    for pool in (top, rest):
+        for idx in pool[np.lexsort((pool, -scores[pool]))]:
+            if len(selected_indices) >= num_frames:
+                break
+            if not blocked[idx]:
+                selected_indices.append(int(idx))
+                blocked[max(0, idx - gap):idx + gap + 1] = True
+    
+    # If we don't have enough frames, fill with the earliest ones that add good
+    # temporal coverage (more than 5 positions from every selected frame)
+    near = np.zeros(total, dtype=bool)
+    for idx in selected_indices:
+        near[max(0, idx - 5):idx + 6] = True
+    for idx in np.flatnonzero(~near):
         if len(selected_indices) >= num_frames:
             break
-        
-        # Avoid selecting frames too close together
-        if not selected_indices or min(abs(idx - si) for si in selected_indices) > len(frames) // (num_frames * 2):
-            selected_indices.append(idx)
-            selected_frames.append(frame)
-    
-    # If we don't have enough frames, fill with evenly distributed ones
-    while len(selected_frames) < num_frames and len(selected_frames) < len(frames):
-        # Find gaps in temporal coverage
-        selected_indices.sort()
-        for i in range(len(frames)):
-            if i not in selected_indices:
-                # Check if this frame adds good temporal coverage
-                if not selected_indices or min(abs(i - si) for si in selected_indices) > 5:
-                    selected_indices.append(i)
-                    selected_frames.append(frames[i])
-                    break
-        else:
-            break
+        if not near[idx]:
+            selected_indices.append(int(idx))
+            near[max(0, idx - 5):idx + 6] = True
     
     # Sort selected frames by original temporal order
-    indexed_frames = [(selected_indices[i], selected_frames[i]) for i in range(len(selected_frames))]
-    indexed_frames.sort(key=lambda x: x[0])
+    return sorted(selected_indices)
+
+def _calculate_interactivity_score(frame: np.ndarray, area_scale: float = 1.0,
+                                   gray: Optional[np.ndarray] = None) -> float:
+    """
+    Calculate a score indicating how likely a frame is to show interactivity,
+    from the frame's own content. Activity relative to neighbouring frames is
+    scored for a whole sequence at once by _calculate_frame_differences.
+    area_scale shrinks pixel-count thresholds when scoring downscaled frames;
+    pass gray if the grayscale conversion is already available.
+    """
+    if gray is None:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(gray, 50, 150)
     
-    return [frame for _, frame in indexed_frames]
+    score = _calculate_detail_score(frame, gray, edges, area_scale)
+    score += _calculate_stack_scores(gray, edges)
+    
+    return float(score)
 
-def _calculate_interactivity_score(frame: np.ndarray, frame_idx: int, all_frames: List[np.ndarray]) -> float:
+def _calculate_detail_score(frame: np.ndarray, gray: np.ndarray, edges: np.ndarray,
+                            area_scale: float = 1.0) -> float:
     """
-    Calculate a score indicating how likely a frame is to show interactivity
+    Score the detectors that inspect a frame's layout (blobs, contours, histogram),
+    given its grayscale and Canny edge images
     """
+    # Convert once and share the results between detectors. With OpenCL the HSV
+    # image stays on the device, and only the highlight pixel counts come back
+    src = cv2.UMat(frame) if USE_OPENCL else frame
+    hsv = cv2.cvtColor(src, cv2.COLOR_BGR2HSV)
+    
     score = 0.0
     
     # 1. Detect potential cursor/mouse indicators
-    score += _detect_cursor_indicators(frame) * 3.0
+    score += _detect_cursor_indicators(gray, area_scale) * 3.0
     
     # 2. Detect UI state changes (hover effects, selections)
-    score += _detect_ui_state_changes(frame) * 2.0
+    score += _detect_ui_state_changes(hsv, area_scale) * 2.0
     
     # 3. Detect form interactions (focus states, input fields)
-    score += _detect_form_interactions(frame) * 2.5
+    score += _detect_form_interactions(edges, area_scale) * 2.5
     
     # 4. Detect modal dialogs or popups
-    score += _detect_modal_dialogs(frame) * 2.0
+    score += _detect_modal_dialogs(gray, area_scale) * 2.0
     
-    # 5. Calculate frame difference (activity level)
-    if frame_idx > 0 and frame_idx < len(all_frames) - 1:
-        prev_frame = all_frames[frame_idx - 1]
-        next_frame = all_frames[frame_idx + 1]
-        score += _calculate_frame_difference(frame, prev_frame, next_frame) * 1.0
-    
-    # 6. Avoid completely black or white frames
-    score += _avoid_blank_frames(frame) * 1.5
+    return score
+
+def _calculate_stack_scores(grays: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """
+    Score the whole-image statistics for a single frame or a (T, H, W) stack of
+    grayscale frames and their edge maps, one vectorized pass per statistic
+    """
+    # 5. Avoid completely black or white frames
+    scores = _avoid_blank_frames(grays) * 1.5
     
-    # 7. Prefer frames with rich UI content
-    score += _detect_ui_complexity(frame) * 1.0
+    # 6. Prefer frames with rich UI content
+    scores += _detect_ui_complexity(edges) * 1.0
     
-    return score
+    return scores
 
-def _detect_cursor_indicators(frame: np.ndarray) -> float:
+def _detect_cursor_indicators(gray: np.ndarray, area_scale: float = 1.0) -> float:
     """
-    Detect potential cursor or mouse interaction indicators
+    Detect potential cursor or mouse interaction indicators in a grayscale frame
     """
     score = 0.0
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     
     # Look for small bright spots that could be cursors
     # Cursors are typically small, bright, and have distinct shapes
     _, thresh = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY)
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    areas, widths, heights, _ = _contour_geometry(contours)
     
-    for contour in contours:
-        area = cv2.contourArea(contour)
-        if 10 < area < 200:  # Cursor-like size
-            x, y, w, h = cv2.boundingRect(contour)
-            aspect_ratio = w / h if h > 0 else 0
-            if 0.5 < aspect_ratio < 2.0:  # Reasonable cursor proportions
-                score += 0.3
+    # Cursor-like size with reasonable cursor proportions
+    aspect_ratios = widths / heights
+    cursors = ((10 * area_scale < areas) & (areas < 200 * area_scale) &
+               (0.5 < aspect_ratios) & (aspect_ratios < 2.0))
+    score += 0.3 * np.count_nonzero(cursors)
     
     return min(score, 1.0)
 
-def _detect_ui_state_changes(frame: np.ndarray) -> float:
+def _detect_ui_state_changes(hsv, area_scale: float = 1.0) -> float:
     """
-    Detect UI elements that might indicate hover states or selections
+    Detect UI elements that might indicate hover states or selections,
+    using the HSV frame (numpy array or cv2.UMat) for better color detection
     """
     score = 0.0
     
-    # Convert to HSV for better color detection
-    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-    
     # Look for highlighted elements (often blue, green, or bright colors)
     # Define ranges for common highlight colors
     highlight_ranges = [
@@ -172,108 +651,127 @@ def _detect_ui_state_changes(frame: np.ndarray) -> float:
     for lower, upper in highlight_ranges:
         mask = cv2.inRange(hsv, np.array(lower), np.array(upper))
         highlight_pixels = cv2.countNonZero(mask)
-        if highlight_pixels > 100:  # Significant highlighted area
+        if highlight_pixels > 100 * area_scale:  # Significant highlighted area
             score += 0.2
     
     return min(score, 1.0)
 
-def _detect_form_interactions(frame: np.ndarray) -> float:
+def _detect_form_interactions(edges: np.ndarray, area_scale: float = 1.0) -> float:
     """
-    Detect form fields with focus states or active cursors
+    Detect form fields with focus states or active cursors from a Canny edge map
     """
     score = 0.0
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     
     # Detect rectangular shapes that could be form fields
-    edges = cv2.Canny(gray, 50, 150)
     contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    _, widths, heights, perimeters = _contour_geometry(contours)
     
-    for contour in contours:
-        # Approximate contour to polygon
-        epsilon = 0.02 * cv2.arcLength(contour, True)
-        approx = cv2.approxPolyDP(contour, epsilon, True)
-        
-        if len(approx) == 4:  # Rectangular shape
-            x, y, w, h = cv2.boundingRect(contour)
-            aspect_ratio = w / h if h > 0 else 0
-            area = w * h
-            
-            # Form field characteristics
-            if 2 < aspect_ratio < 10 and 500 < area < 50000:
-                score += 0.1
+    # Form field characteristics, checked for every contour at once
+    aspect_ratios = widths / heights
+    box_areas = widths * heights
+    candidates = np.flatnonzero((2 < aspect_ratios) & (aspect_ratios < 10) &
+                                (500 * area_scale < box_areas) & (box_areas < 50000 * area_scale))
+    
+    for i in candidates:
+        # Approximate contour to polygon; rectangular shapes have four corners
+        approx = cv2.approxPolyDP(contours[i], 0.02 * perimeters[i], True)
+        if len(approx) == 4:
+            score += 0.1
     
     return min(score, 1.0)
 
-def _detect_modal_dialogs(frame: np.ndarray) -> float:
+def _contour_geometry(contours) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """
-    Detect modal dialogs or popup windows
+    Compute the area, bounding box width and height, and closed perimeter of
+    every contour in one vectorized pass over their concatenated points,
+    matching cv2.contourArea, cv2.boundingRect and cv2.arcLength.
+    """
+    if len(contours) == 0:
+        empty = np.zeros(0)
+        return empty, empty, empty, empty
+    
+    lengths = np.array([len(contour) for contour in contours])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+    
+    # Index of the next point around each closed contour
+    following = np.arange(len(points)) + 1
+    following[starts + lengths - 1] = starts
+    x, y = points[:, 0], points[:, 1]
+    nx, ny = x[following], y[following]
+    
+    # Shoelace formula for the area, summed per contour
+    areas = np.abs(np.add.reduceat(x * ny - nx * y, starts)) / 2
+    perimeters = np.add.reduceat(np.hypot(nx - x, ny - y), starts)
+    widths = np.maximum.reduceat(x, starts) - np.minimum.reduceat(x, starts) + 1
+    heights = np.maximum.reduceat(y, starts) - np.minimum.reduceat(y, starts) + 1
+    
+    return areas, widths, heights, perimeters
+
+def _detect_modal_dialogs(gray: np.ndarray, area_scale: float = 1.0) -> float:
+    """
+    Detect modal dialogs or popup windows in a grayscale frame
     """
     score = 0.0
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     
     # Look for overlay patterns (darker background with bright foreground)
     # Calculate histogram to detect bimodal distribution
     hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
     
-    # Find peaks in histogram
-    peaks = []
-    for i in range(1, 255):
-        if hist[i] > hist[i-1] and hist[i] > hist[i+1] and hist[i] > 1000:
-            peaks.append(i)
+    # Find peaks in histogram (bins higher than both neighbors)
+    h = hist.ravel()
+    is_peak = (h[1:-1] > h[:-2]) & (h[1:-1] > h[2:]) & (h[1:-1] > 1000 * area_scale)
+    peaks = np.flatnonzero(is_peak) + 1
     
     # Modal dialogs often create bimodal intensity distribution
     if len(peaks) >= 2:
-        peak_separation = max(peaks) - min(peaks)
+        peak_separation = peaks[-1] - peaks[0]
         if peak_separation > 100:  # Significant contrast
             score += 0.5
     
     return min(score, 1.0)
 
-def _calculate_frame_difference(current: np.ndarray, prev: np.ndarray, next: np.ndarray) -> float:
+def _calculate_frame_differences(grays: np.ndarray) -> np.ndarray:
     """
-    Calculate how much a frame differs from its neighbors (indicates activity)
+    Calculate how much each frame differs from its neighbors (indicates activity),
+    for a (T, H, W) stack of grayscale frames in one vectorized pass. The first
+    and last frames lack a neighbor on one side and score 0.
     """
-    # Convert to grayscale for comparison
-    curr_gray = cv2.cvtColor(current, cv2.COLOR_BGR2GRAY)
-    prev_gray = cv2.cvtColor(prev, cv2.COLOR_BGR2GRAY)
-    next_gray = cv2.cvtColor(next, cv2.COLOR_BGR2GRAY)
-    
-    # Calculate differences
-    diff_prev = cv2.absdiff(curr_gray, prev_gray)
-    diff_next = cv2.absdiff(curr_gray, next_gray)
-    
-    # Sum of differences normalized
-    total_diff = np.sum(diff_prev) + np.sum(diff_next)
-    max_possible = curr_gray.size * 255 * 2
-    
-    return total_diff / max_possible
+    differences = np.zeros(len(grays))
+    if len(grays) < 3:
+        return differences
+    
+    # Sum of absolute differences to both neighbors, normalized
+    middle = grays[1:-1].astype(np.int16)
+    total_diff = (np.abs(middle - grays[:-2]).sum(axis=(1, 2), dtype=np.int64) +
+                  np.abs(middle - grays[2:]).sum(axis=(1, 2), dtype=np.int64))
+    max_possible = grays[0].size * 255 * 2
+    
+    differences[1:-1] = total_diff / max_possible
+    return differences
 
-def _avoid_blank_frames(frame: np.ndarray) -> float:
+def _avoid_blank_frames(grays: np.ndarray) -> np.ndarray:
     """
-    Penalize completely black, white, or very uniform frames
+    Penalize completely black, white, or very uniform frames, for a single
+    grayscale frame or a (T, H, W) stack
     """
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    
-    # Calculate standard deviation of pixel intensities
-    std_dev = np.std(gray)
-    
-    # Frames with very low std dev are likely blank or uniform
-    if std_dev < 10:
-        return 0.0  # Heavily penalize blank frames
-    elif std_dev < 30:
-        return 0.3  # Moderately penalize uniform frames
-    else:
-        return 1.0  # Reward frames with good variation
+    # Standard deviation of pixel intensities from E[x^2] - E[x]^2, which keeps
+    # the temporary at 16 bits per pixel instead of float64
+    mean = grays.mean(axis=(-2, -1))
+    mean_sq = np.square(grays, dtype=np.uint16).mean(axis=(-2, -1))
+    std_dev = np.sqrt(np.maximum(mean_sq - mean ** 2, 0.0))
+    
+    # Frames with very low std dev are likely blank or uniform: heavily penalize
+    # blank frames, moderately penalize uniform ones, reward good variation
+    return np.select([std_dev < 10, std_dev < 30], [0.0, 0.3], default=1.0)
 
-def _detect_ui_complexity(frame: np.ndarray) -> float:
+def _detect_ui_complexity(edges: np.ndarray) -> np.ndarray:
     """
-    Detect UI complexity (more complex UIs are more likely to be interactive)
+    Detect UI complexity (more complex UIs are more likely to be interactive),
+    for a single edge map or a (T, H, W) stack
     """
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    
-    # Use edge detection to measure UI complexity
-    edges = cv2.Canny(gray, 50, 150)
-    edge_density = np.sum(edges > 0) / edges.size
+    # Use edge density to measure UI complexity
+    edge_density = np.count_nonzero(edges, axis=(-2, -1)) / (edges.shape[-2] * edges.shape[-1])
     
     # Normalize edge density to 0-1 score
-    return min(edge_density * 10, 1.0)
+    return np.minimum(edge_density * 10, 1.0)
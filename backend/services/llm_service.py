@@ -1,86 +1,99 @@
+import asyncio
+import base64
+import cv2
+import functools
+import hashlib
 import json
+import numpy as np
+import orjson
+import os
+import random
+import re
 import requests
+import threading
 import time
-from typing import List, Dict
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Optional, Tuple, Union
+from dotenv import load_dotenv
 
-class LLMService:
-    def __init__(self):
-        import os
-        from dotenv import load_dotenv
-        
-        # Load environment variables from .env file
-        load_dotenv()
-        
-        self.api_key = os.getenv('ANTHROPIC_API_KEY')
-        if not self.api_key:
-            raise ValueError("ANTHROPIC_API_KEY environment variable is required")
-        self.api_url = "https://api.anthropic.com/v1/messages"
-        self.model = "claude-3-5-sonnet-20241022"
-    
-    def evaluate_submissions(self, frames_a: List[str], frames_b: List[str], 
-                           task_desc: str, criteria: List[str],
-                           name_a: str, name_b: str) -> Dict:
-        """
-        Evaluate two submissions using Claude API with image analysis
-        """
-        try:
-            # Create evaluation prompt
-            prompt = self._create_evaluation_prompt(task_desc, criteria, name_a, name_b)
-            
-            # Prepare images for API call
-            content = [{"type": "text", "text": prompt}]
-            
-            # Add images from both submissions
-            for i, frame_b64 in enumerate(frames_a[:3]):  # Limit to 3 frames per submission
-                content.append({
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/jpeg",
-                        "data": frame_b64
-                    }
-                })
-            
-            for i, frame_b64 in enumerate(frames_b[:3]):
-                content.append({
-                    "type": "image", 
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/jpeg",
-                        "data": frame_b64
-                    }
-                })
-            
-            # Make API call with retry logic
-            response = self._make_api_call_with_retry(content)
-            
-            # Parse response
-            return self._parse_evaluation_response(response, name_a, name_b)
-            
-        except Exception as e:
-            print(f"Error in Claude API evaluation: {e}")
-            # Fallback to simulated response if API fails
-            return self._fallback_evaluation(name_a, name_b)
-    
-    def _create_evaluation_prompt(self, task_desc: str, criteria: List[str], name_a: str, name_b: str) -> str:
-        """
-        Create detailed evaluation prompt for Claude with improved screenshot handling
-        """
-        criteria_text = "\n".join([f"- {criterion}" for criterion in criteria])
-        
-        return f"""You are an expert evaluator comparing two project submissions. 
+# Load environment variables from .env file once, when the module is first imported
+load_dotenv()
 
-TASK DESCRIPTION:
-{task_desc}
+# A frame is a public image URL, base64-encoded JPEG data, or raw JPEG bytes
+Frame = Union[str, bytes]
 
-EVALUATION CRITERIA:
-{criteria_text}
+# Retries for transient API failures (rate limits, overload, server errors, dropped
+# connections). Delays follow decorrelated jitter unless the API sends Retry-After;
+# other 4xx errors are not retried since the same request would fail again.
+API_MAX_RETRIES = 3
+API_RETRY_BASE_DELAY = 1.0
+API_RETRY_MAX_DELAY = 32.0
+API_RETRY_STATUSES = (408, 429, 500, 502, 503, 504, 529)
 
-I will show you screenshots from two demo videos:
-- First images: Submission by {name_a}
-- Remaining images: Submission by {name_b}
+# A non-streamed call returns only once the whole completion is generated, so its
+# timeout is a base allowance plus the output budget at a conservative output rate
+API_BASE_TIMEOUT = 30
+API_MIN_OUTPUT_TOKENS_PER_SECOND = 40
 
-🚨 CRITICAL SCREENSHOT QUALITY ASSESSMENT:
+# Evaluations are answered as bare JSON: the system prompt asks for it and the
+# assistant turn is prefilled with the opening brace, so no prose precedes it
+JSON_SYSTEM_PROMPT = "Respond with ONLY a JSON object, no prose."
+JSON_PREFILL = "{"
+
+# The verdict field of a pair evaluation. It comes first, so it can be read from a
+# streamed response before the feedback has finished, or from a cut-off response
+WINNER_FIELD_RE = re.compile(r'"winner"\s*:\s*"([AB])"')
+
+# Connection pool for api.anthropic.com: pools kept per host, connections kept per pool
+API_POOL_CONNECTIONS = 50
+API_POOL_MAXSIZE = 200
+
+# Pair evaluations remembered by exact inputs (frames, task, criteria, names), least
+# recently used first out, so repeated comparisons skip the Claude call
+EVALUATION_CACHE_SIZE = 1024
+
+# Pairs judged per Claude call by evaluate_batch; each submission's frames add ~2.4k
+# input tokens and each verdict needs output budget, so batches stay small
+MAX_PAIRS_PER_BATCH = 5
+
+# Message Batches API polling: how often to check a submitted batch and how long
+# to wait before giving up (batches can take up to 24 hours to finish)
+BATCH_POLL_INTERVAL = 30
+BATCH_TIMEOUT = 24 * 60 * 60
+
+# Pair evaluations in flight at once when evaluating many pairs together
+DEFAULT_EVALUATION_CONCURRENCY = 10
+
+# Client-side budget for Claude calls, so concurrent evaluations wait instead of
+# drawing 429s. The per-minute limits can be raised to match the account's tier
+# with the ANTHROPIC_RPM_LIMIT and ANTHROPIC_TPM_LIMIT environment variables.
+MAX_CONCURRENT_API_CALLS = 8
+DEFAULT_RPM_LIMIT = 50
+DEFAULT_TPM_LIMIT = 100000
+
+# Output budget for a pair verdict. A verdict runs ~400-600 tokens, and the budget
+# counts against the token rate limit, so it is kept close to that; override with
+# ANTHROPIC_MAX_OUTPUT_TOKENS if responses are cut off (see the max_tokens warning).
+# A verdict cut off at that budget is retried once with the larger retry budget.
+DEFAULT_MAX_OUTPUT_TOKENS = 800
+TRUNCATED_RETRY_MAX_TOKENS = 2000
+
+# Rough token cost of one frame (~1024x576 px at ~750 px per token)
+IMAGE_TOKEN_ESTIMATE = 800
+
+# Frames passed in larger than this on the long edge are downscaled before sending,
+# since image tokens scale with pixel count. Extracted frames are already this size.
+MAX_IMAGE_DIMENSION = 1024
+RESIZED_JPEG_QUALITY = 85
+
+# Threads decoding and downscaling the new frames of a call in parallel (OpenCV
+# releases the GIL); one call sends at most 6 frames per pair
+IMAGE_PREP_WORKERS = 6
+
+# Shared screenshot-handling and scoring guidance used by both pairwise and group prompts
+EVALUATION_GUIDELINES = """🚨 CRITICAL SCREENSHOT QUALITY ASSESSMENT:
 These are automatically extracted video frames that may have significant limitations:
 
 SCREENSHOT QUALITY IS UNRELIABLE - FOCUS ON TECHNICAL EVIDENCE:
@@ -168,13 +181,45 @@ TECHNICAL HIERARCHY (Higher wins unless completely broken):
 - Database integration > Local storage > No persistence  
 - Custom implementations > Template modifications
 - Interactive features > Static presentations
-- Complex state management > Simple static content
+- Complex state management > Simple static content"""
+
+EVALUATION_REMINDER = """🚨 CRITICAL EVALUATION REMINDER:
+- A submission that LOOKS simpler in screenshots may actually be MORE technically advanced
+- Screenshots can be misleading - focus on ANY evidence of technical complexity
+- Advanced features like demos, downloads, pagination, and state management are often not visible in static frames
+- When in doubt between two submissions, favor the one with ANY indicators of advanced technical implementation
+- Don't let poor screenshot quality or timing hide superior technical work
+
+Remember: Be generous with poor screenshots, focus on technical implementation evidence, and reward interactivity indicators like mouse cursors and dynamic states."""
+
+@functools.lru_cache(maxsize=32)
+def _build_pair_prompt(task_desc: str, criteria: Tuple[str, ...]) -> str:
+    """
+    Build the static pairwise evaluation prompt for a task once. It names no
+    submitters, so every pair in a tournament shares it as a cacheable prefix.
+    """
+    criteria_text = "\n".join([f"- {criterion}" for criterion in criteria])
+    
+    return f"""You are an expert evaluator comparing two project submissions. 
+
+TASK DESCRIPTION:
+{task_desc}
+
+EVALUATION CRITERIA:
+{criteria_text}
+
+I will show you screenshots from two demo videos. Each submission's screenshots follow its label:
+- "Submission A:" precedes the first submission's screenshots
+- "Submission B:" precedes the second submission's screenshots
+The submitters' names follow the screenshots.
+
+{EVALUATION_GUIDELINES}
 
 Respond with a JSON object in this exact format:
 {{
     "winner": "A" or "B",
-    "feedback_a": "Detailed feedback for {name_a}'s submission",
-    "feedback_b": "Detailed feedback for {name_b}'s submission", 
+    "feedback_a": "Detailed feedback for submission A",
+    "feedback_b": "Detailed feedback for submission B", 
     "pros_cons_a": {{
         "pros": ["list", "of", "strengths"],
         "cons": ["list", "of", "weaknesses"]
@@ -185,76 +230,769 @@ Respond with a JSON object in this exact format:
     }}
 }}
 
-🚨 CRITICAL EVALUATION REMINDER:
-- A submission that LOOKS simpler in screenshots may actually be MORE technically advanced
-- Screenshots can be misleading - focus on ANY evidence of technical complexity
-- Advanced features like demos, downloads, pagination, and state management are often not visible in static frames
-- When in doubt between two submissions, favor the one with ANY indicators of advanced technical implementation
-- Don't let poor screenshot quality or timing hide superior technical work
+{EVALUATION_REMINDER}"""
 
-Remember: Be generous with poor screenshots, focus on technical implementation evidence, and reward interactivity indicators like mouse cursors and dynamic states."""
+@functools.lru_cache(maxsize=32)
+def _build_group_prompt(task_desc: str, criteria: Tuple[str, ...]) -> str:
+    """
+    Build the static group evaluation prompt for a task once; the submissions
+    and pairs of each batch are sent after the screenshots
+    """
+    criteria_text = "\n".join([f"- {criterion}" for criterion in criteria])
+    
+    return f"""You are an expert evaluator comparing several project submissions. 
+
+TASK DESCRIPTION:
+{task_desc}
+
+EVALUATION CRITERIA:
+{criteria_text}
+
+I will show you screenshots from several demo videos. Each submission's screenshots follow its label (S1, S2, ...).
+
+{EVALUATION_GUIDELINES}
+
+After the screenshots you will get a list of pairs to compare. In each pair, "A" is the first submission listed and "B" is the second.
+
+Respond with a JSON object in this exact format:
+{{
+    "submissions": {{
+        "S1": {{
+            "feedback": "Detailed feedback for this submission",
+            "pros_cons": {{
+                "pros": ["list", "of", "strengths"],
+                "cons": ["list", "of", "weaknesses"]
+            }}
+        }}
+    }},
+    "comparisons": [
+        {{"a": "S1", "b": "S2", "winner": "A" or "B"}}
+    ]
+}}
+
+Include an entry in "submissions" for every submission shown and an entry in "comparisons" for every pair listed.
+
+{EVALUATION_REMINDER}"""
+
+def _downscale_jpeg(data: bytes) -> Optional[bytes]:
+    """
+    Re-encode an image whose long edge exceeds MAX_IMAGE_DIMENSION as a smaller
+    JPEG. Returns None if the image is already small enough or can't be decoded.
+    """
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) if data else None
+    if image is None:
+        return None
+    
+    height, width = image.shape[:2]
+    scale = MAX_IMAGE_DIMENSION / max(height, width)
+    if scale >= 1:
+        return None
+    
+    image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, RESIZED_JPEG_QUALITY])
+    return buffer.tobytes() if ok else None
+
+@functools.lru_cache(maxsize=1024)
+def _build_image_block(frame: Frame) -> Dict:
+    """
+    Image content block for a frame URL, base64 frame or raw JPEG bytes, memoized
+    so a submission compared many times reuses the same block objects. Oversized
+    frames are downscaled and raw bytes are base64-encoded here, once per frame.
+    """
+    if isinstance(frame, str) and frame.startswith(('http://', 'https://')):
+        return {"type": "image", "source": {"type": "url", "url": frame}}
+    
+    try:
+        data = frame if isinstance(frame, bytes) else base64.b64decode(frame)
+    except ValueError:
+        data = b''  # Not valid base64; send the frame as given
+    resized = _downscale_jpeg(data)
+    if resized is not None:
+        frame = resized
+    if isinstance(frame, bytes):
+        frame = base64.b64encode(frame).decode('ascii')
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": "image/jpeg",
+            "data": frame
+        }
+    }
+
+@functools.lru_cache(maxsize=256)
+def _winner_pattern(name_a: str, name_b: str) -> re.Pattern:
+    """
+    Regex matching a submitter's name followed shortly by "better" with no other
+    name in between, used to guess the winner from a response that isn't JSON
+    """
+    names = "|".join(re.escape(name) for name in (name_a, name_b))
+    return re.compile(rf"(?<!\w)({names})(?!\w)(?:(?!{names}).){{0,60}}?\bbetter\b",
+                      re.IGNORECASE | re.DOTALL)
+
+class _RateLimiter:
+    """
+    Thread-safe token bucket refilled continuously at `per_minute` units per minute
+    """
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self, amount: float = 1.0) -> None:
+        """
+        Block until `amount` units are available, then take them. Requests larger
+        than the whole bucket wait for a full bucket instead of forever.
+        """
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+class LLMService:
+    def __init__(self):
+        self.api_key = os.getenv('ANTHROPIC_API_KEY')
+        if not self.api_key:
+            raise ValueError("ANTHROPIC_API_KEY environment variable is required")
+        self.api_url = "https://api.anthropic.com/v1/messages"
+        self.batches_url = "https://api.anthropic.com/v1/messages/batches"
+        self.model = "claude-3-5-sonnet-20241022"
+        
+        # Pooled session so retries and repeated evaluations reuse a warm TLS connection.
+        # Retries are handled in _make_api_call_with_retry, not by the adapter.
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=API_POOL_CONNECTIONS,
+                                                   pool_maxsize=API_POOL_MAXSIZE, max_retries=0))
+        
+        # Results of earlier pair evaluations, keyed by a hash of their inputs
+        self.evaluation_cache = OrderedDict()
+        self.evaluation_cache_lock = threading.Lock()
+        
+        # Open the TLS connection in the background so the first evaluation skips the handshake
+        threading.Thread(target=self._warm_connection, daemon=True).start()
+        
+        # Concurrency and per-minute request/token budgets shared by all calls
+        self.api_semaphore = threading.BoundedSemaphore(MAX_CONCURRENT_API_CALLS)
+        
+        # Shared pool for building image blocks, see _prepare_image_blocks
+        self.image_executor = ThreadPoolExecutor(max_workers=IMAGE_PREP_WORKERS)
+        self.request_limiter = _RateLimiter(int(os.getenv('ANTHROPIC_RPM_LIMIT', DEFAULT_RPM_LIMIT)))
+        self.token_limiter = _RateLimiter(int(os.getenv('ANTHROPIC_TPM_LIMIT', DEFAULT_TPM_LIMIT)))
+        self.max_output_tokens = int(os.getenv('ANTHROPIC_MAX_OUTPUT_TOKENS', DEFAULT_MAX_OUTPUT_TOKENS))
+    
+    def _warm_connection(self) -> None:
+        """
+        Establish a pooled connection to the API with a cheap HEAD request
+        """
+        try:
+            self.session.head(self.api_url, timeout=5)
+        except requests.exceptions.RequestException as e:
+            print(f"API connection pre-warm failed: {e}")
+    
+    def evaluate_submissions(self, frames_a: List[Frame], frames_b: List[Frame], 
+                           task_desc: str, criteria: List[str],
+                           name_a: str, name_b: str,
+                           on_winner: Optional[Callable[[str], None]] = None) -> Dict:
+        """
+        Evaluate two submissions using Claude API with image analysis.
+        Identical requests are answered from the evaluation cache.
+        If on_winner is given, the response is streamed and on_winner is called
+        with the verdict ('A' or 'B') as soon as it is known, before the feedback
+        has finished generating. A stream can still fail after that, and a retry or
+        fallback may reach a different verdict; on_winner is then called again, so
+        its last call always matches the returned result's winner.
+        """
+        reported = []
+        def notify(winner: str) -> None:
+            if on_winner is not None and (not reported or reported[-1] != winner):
+                reported.append(winner)
+                on_winner(winner)
+        
+        cache_key = self._evaluation_cache_key(frames_a[:3], frames_b[:3], task_desc, criteria, name_a, name_b)
+        with self.evaluation_cache_lock:
+            cached = self.evaluation_cache.get(cache_key)
+            if cached is not None:
+                self.evaluation_cache.move_to_end(cache_key)
+        if cached is not None:
+            notify(cached['winner'])
+            return cached
+        
+        try:
+            content = self._create_pair_content(frames_a, frames_b, task_desc, criteria, name_a, name_b)
+            
+            # Make API call with retry logic
+            response = self._make_api_call_with_retry(content, on_winner=notify if on_winner else None)
+            truncated = response.get('stop_reason') == 'max_tokens'
+            if truncated and self.max_output_tokens < TRUNCATED_RETRY_MAX_TOKENS:
+                # The feedback was cut off; ask once more with room for the whole verdict
+                response = self._make_api_call_with_retry(content, max_tokens=TRUNCATED_RETRY_MAX_TOKENS,
+                                                          on_winner=notify if on_winner else None)
+            
+            # Parse response
+            result, complete = self._parse_evaluation_response(response, name_a, name_b)
+            
+        except Exception as e:
+            print(f"Error in Claude API evaluation: {e}")
+            result, complete = None, False
+        
+        if result is None:
+            # Fallback to simulated response if the API call or parsing fails
+            result = self._fallback_evaluation(name_a, name_b)
+            notify(result['winner'])
+            return result
+        
+        notify(result['winner'])
+        if not complete:
+            # Keep the real verdict, but let the next run retry for full feedback
+            return result
+        
+        # Only real responses are cached, so a failed call is retried next time
+        with self.evaluation_cache_lock:
+            self.evaluation_cache[cache_key] = result
+            if len(self.evaluation_cache) > EVALUATION_CACHE_SIZE:
+                self.evaluation_cache.popitem(last=False)
+        return result
+    
+    def _evaluation_cache_key(self, frames_a: List[Frame], frames_b: List[Frame], task_desc: str,
+                              criteria: List[str], name_a: str, name_b: str) -> str:
+        """
+        Hash everything that shapes a pair evaluation into a cache key
+        """
+        digest = hashlib.sha256()
+        for part in (*frames_a, "|", *frames_b, "|", task_desc, "|", *criteria, "|", name_a, "|", name_b):
+            digest.update(part if isinstance(part, bytes) else part.encode('utf-8'))
+            digest.update(b"\0")
+        return digest.hexdigest()
+    
+    async def aevaluate_submissions(self, frames_a: List[Frame], frames_b: List[Frame],
+                                    task_desc: str, criteria: List[str],
+                                    name_a: str, name_b: str,
+                                    on_winner: Optional[Callable[[str], None]] = None) -> Dict:
+        """
+        Async variant of evaluate_submissions. The blocking HTTP call runs on a
+        worker thread, so the event loop stays free while Claude responds.
+        on_winner is called on the event loop, so it can e.g. set an asyncio.Event;
+        as with evaluate_submissions, a changed verdict is reported again.
+        """
+        if on_winner is not None:
+            loop = asyncio.get_running_loop()
+            callback = on_winner
+            on_winner = lambda winner: loop.call_soon_threadsafe(callback, winner)
+        
+        return await asyncio.to_thread(self.evaluate_submissions, frames_a, frames_b,
+                                       task_desc, criteria, name_a, name_b, on_winner)
+    
+    async def aevaluate_many(self, pair_inputs: List[Dict],
+                             concurrency: int = DEFAULT_EVALUATION_CONCURRENCY) -> List[Dict]:
+        """
+        Evaluate many submission pairs concurrently, at most `concurrency` at a time.
+        Each item holds evaluate_submissions' keyword arguments; results keep input order.
+        """
+        # A dedicated pool sized to the concurrency limit bounds the calls in flight;
+        # the default executor can be smaller than the limit on machines with few CPUs
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            return await asyncio.gather(*(
+                loop.run_in_executor(executor, functools.partial(self.evaluate_submissions, **pair))
+                for pair in pair_inputs
+            ))
+    
+    def evaluate_many(self, pair_inputs: List[Dict],
+                      concurrency: int = DEFAULT_EVALUATION_CONCURRENCY) -> List[Dict]:
+        """
+        Synchronous wrapper around aevaluate_many for callers without an event loop
+        """
+        return asyncio.run(self.aevaluate_many(pair_inputs, concurrency))
+    
+    def evaluate_batch(self, pairs: List[Tuple[List[Frame], List[Frame], str, str]],
+                       task_desc: str, criteria: List[str]) -> List[Dict]:
+        """
+        Evaluate independent (frames_a, frames_b, name_a, name_b) pairs with as few
+        Claude calls as possible. Pairs are judged MAX_PAIRS_PER_BATCH at a time through
+        evaluate_group, sending a submission's frames once even if it appears in several
+        pairs. Pairs Claude skips get a dedicated call. Results keep input order.
+        """
+        results = []
+        for start in range(0, len(pairs), MAX_PAIRS_PER_BATCH):
+            chunk = pairs[start:start + MAX_PAIRS_PER_BATCH]
+            
+            # Index each distinct submission (by name and frames) within the chunk
+            positions = {}
+            frames_by_submission, names, indexed_pairs = [], [], []
+            for frames_a, frames_b, name_a, name_b in chunk:
+                indexed = []
+                for frames, name in ((frames_a, name_a), (frames_b, name_b)):
+                    key = (name, tuple(frames[:3]))
+                    if key not in positions:
+                        positions[key] = len(names)
+                        frames_by_submission.append(frames)
+                        names.append(name)
+                    indexed.append(positions[key])
+                indexed_pairs.append(tuple(indexed))
+            
+            group_results = self.evaluate_group(frames_by_submission, names, indexed_pairs, task_desc, criteria)
+            for (frames_a, frames_b, name_a, name_b), pair in zip(chunk, indexed_pairs):
+                result = group_results.get(pair)
+                if result is None:
+                    result = self.evaluate_submissions(frames_a, frames_b, task_desc, criteria, name_a, name_b)
+                results.append(result)
+        
+        return results
+    
+    def submit_batch_tournament(self, pairs: List[Tuple[List[Frame], List[Frame], str, str]],
+                                task_desc: str, criteria: List[str],
+                                poll_interval: float = BATCH_POLL_INTERVAL,
+                                timeout: float = BATCH_TIMEOUT) -> List[Dict]:
+        """
+        Evaluate (frames_a, frames_b, name_a, name_b) pairs through the Message
+        Batches API, which costs half as much and doesn't count against per-minute
+        rate limits but can take minutes to hours. Blocks until the batch ends, so
+        it suits offline tournament scoring; interactive callers should keep using
+        evaluate_submissions. If the batch can't be submitted or doesn't finish in
+        time, the pairs are evaluated with direct calls instead. Results keep input order.
+        """
+        if not pairs:
+            return []
+        
+        batch_requests = [
+            {
+                "custom_id": f"pair_{idx}",
+                "params": self._message_params(
+                    self._create_pair_content(frames_a, frames_b, task_desc, criteria, name_a, name_b)
+                )
+            }
+            for idx, (frames_a, frames_b, name_a, name_b) in enumerate(pairs)
+        ]
+        
+        try:
+            response = self.session.post(self.batches_url, headers=self._api_headers(),
+                                         data=orjson.dumps({"requests": batch_requests}), timeout=60)
+            response.raise_for_status()
+            results = self._wait_for_batch_results(orjson.loads(response.content)['id'], poll_interval, timeout)
+        except (requests.exceptions.RequestException, TimeoutError, KeyError, ValueError) as e:
+            print(f"Message batch evaluation failed, falling back to direct calls: {e}")
+            return self.evaluate_many([
+                dict(frames_a=frames_a, frames_b=frames_b, task_desc=task_desc,
+                     criteria=criteria, name_a=name_a, name_b=name_b)
+                for frames_a, frames_b, name_a, name_b in pairs
+            ])
+        
+        evaluations = []
+        for idx, (_, _, name_a, name_b) in enumerate(pairs):
+            result = results.get(f"pair_{idx}", {})
+            evaluation = None
+            if result.get('type') == 'succeeded':
+                evaluation, _ = self._parse_evaluation_response(result['message'], name_a, name_b)
+            else:
+                print(f"Batch request pair_{idx} did not succeed: {result.get('type', 'missing')}")
+            evaluations.append(evaluation if evaluation is not None else self._fallback_evaluation(name_a, name_b))
+        return evaluations
+    
+    def _wait_for_batch_results(self, batch_id: str, poll_interval: float, timeout: float) -> Dict[str, Dict]:
+        """
+        Poll a message batch until it ends, then download its results keyed by custom_id
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            response = self.session.get(f"{self.batches_url}/{batch_id}", headers=self._api_headers(), timeout=30)
+            response.raise_for_status()
+            batch = orjson.loads(response.content)
+            if batch['processing_status'] == 'ended':
+                break
+            
+            if time.monotonic() >= deadline:
+                # Stop paying for work nobody will read; failure to cancel is harmless
+                try:
+                    self.session.post(f"{self.batches_url}/{batch_id}/cancel", headers=self._api_headers(), timeout=30)
+                except requests.exceptions.RequestException:
+                    pass
+                raise TimeoutError(f"Message batch {batch_id} did not finish within {timeout}s")
+            time.sleep(poll_interval)
+        
+        # Results are JSON Lines, one entry per request, in no particular order
+        response = self.session.get(batch['results_url'], headers=self._api_headers(), timeout=60)
+        response.raise_for_status()
+        results = {}
+        for line in response.content.splitlines():
+            if line.strip():
+                entry = orjson.loads(line)
+                results[entry['custom_id']] = entry['result']
+        return results
+    
+    def evaluate_group(self, frames_by_submission: List[List[Frame]], names: List[str],
+                       pairs: List[Tuple[int, int]], task_desc: str,
+                       criteria: List[str]) -> Dict[Tuple[int, int], Dict]:
+        """
+        Evaluate several submission pairs in a single Claude call.
+        Each submission's frames are sent once; pairs index into names.
+        Returns results keyed by pair; pairs missing from the response are omitted,
+        and a failed call returns no results so callers compare those pairs directly.
+        """
+        try:
+            prompt = self._create_group_evaluation_prompt(task_desc, criteria)
+            
+            self._prepare_image_blocks([frame for frames in frames_by_submission for frame in frames[:3]])
+            
+            content = [self._cached_text_block(prompt)]
+            seen_frames = {}
+            for idx, frames in enumerate(frames_by_submission):
+                content.append({"type": "text", "text": f"S{idx + 1}: Submission by {names[idx]}"})
+                self._append_frames(content, frames[:3], seen_frames)  # Limit to 3 frames per submission
+            content.append({"type": "text", "text": self._create_group_pairs_text(pairs)})
+            
+            # Feedback for every submission needs a larger output budget than a single pair
+            response = self._make_api_call_with_retry(content, max_tokens=4000)
+            
+            return self._parse_group_response(response, names, pairs)
+            
+        except Exception as e:
+            print(f"Error in Claude API group evaluation: {e}")
+            return {}
+    
+    def _create_pair_content(self, frames_a: List[Frame], frames_b: List[Frame], task_desc: str,
+                             criteria: List[str], name_a: str, name_b: str) -> List[Dict]:
+        """
+        Build the message content for a pair evaluation: the cached task prompt,
+        up to 3 labelled frames from each submission, then the names of the submitters
+        """
+        # Create evaluation prompt
+        prompt = self._create_evaluation_prompt(task_desc, criteria)
+        content = [self._cached_text_block(prompt)]
+        
+        # Add images from both submissions
+        self._prepare_image_blocks(frames_a[:3] + frames_b[:3])
+        seen_frames = {}
+        content.append({"type": "text", "text": "Submission A:"})
+        self._append_frames(content, frames_a[:3], seen_frames)  # Limit to 3 frames per submission
+        content.append({"type": "text", "text": "Submission B:"})
+        self._append_frames(content, frames_b[:3], seen_frames)
+        
+        content.append({"type": "text", "text": self._create_pair_names_text(name_a, name_b)})
+        return content
+    
+    def _create_pair_names_text(self, name_a: str, name_b: str) -> str:
+        """
+        Name the submitters of a pair, sent after the screenshots. Feedback is shown
+        to the applicants, so it must address them by name rather than by A/B label.
+        """
+        return (f"Comparing {name_a} (submission A) vs {name_b} (submission B). "
+                f"Write feedback_a addressed to {name_a} and feedback_b addressed to {name_b}, "
+                f"referring to them by name and never as \"submission A\" or \"submission B\".")
+    
+    def _cached_text_block(self, text: str) -> Dict:
+        """
+        Text block marked for Anthropic prompt caching, so the tokenized prefix up to
+        and including it is reused by later calls within the cache window
+        """
+        return {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+    
+    def _append_frames(self, content: List[Dict], frames: List[Frame], seen_frames: Dict[Frame, int]) -> None:
+        """
+        Append image blocks for frames, sending each distinct frame only once per
+        call. A repeated frame (e.g. the same video submitted twice) becomes a short
+        text note pointing at the earlier image. seen_frames maps frames already
+        sent in this call to their 1-based image number.
+        """
+        for frame in frames:
+            if frame in seen_frames:
+                content.append({"type": "text", "text": f"(frame identical to image {seen_frames[frame]})"})
+            else:
+                seen_frames[frame] = len(seen_frames) + 1
+                content.append(self._image_block(frame))
+    
+    def _prepare_image_blocks(self, frames: List[Frame]) -> None:
+        """
+        Build the image blocks for a call's frames on the image pool, so decoding
+        and downscaling several new frames runs in parallel. The blocks land in the
+        _build_image_block cache, where _append_frames picks them up.
+        """
+        distinct = list(dict.fromkeys(frames))
+        if len(distinct) > 1:
+            list(self.image_executor.map(_build_image_block, distinct))
+    
+    def _image_block(self, frame: Frame) -> Dict:
+        """
+        Build an image content block for a frame given as a public URL, which
+        Claude fetches itself, as base64-encoded JPEG data, or as raw JPEG bytes.
+        Blocks are built once per frame and shared between requests, so they must
+        not be mutated.
+        """
+        return _build_image_block(frame)
+    
+    def _create_evaluation_prompt(self, task_desc: str, criteria: List[str]) -> str:
+        """
+        Create detailed evaluation prompt for Claude with improved screenshot handling
+        """
+        return _build_pair_prompt(task_desc, tuple(criteria))
+
+    def _create_group_evaluation_prompt(self, task_desc: str, criteria: List[str]) -> str:
+        """
+        Create evaluation prompt asking Claude to judge several pairs at once
+        """
+        return _build_group_prompt(task_desc, tuple(criteria))
+    
+    def _create_group_pairs_text(self, pairs: List[Tuple[int, int]]) -> str:
+        """
+        List the pairs a group call should compare, sent after the screenshots,
+        with a reminder to keep the S labels out of the feedback
+        """
+        pairs_text = "\n".join([f"- S{i + 1} vs S{j + 1}" for i, j in pairs])
+        return (f"Compare the following pairs:\n{pairs_text}\n\n"
+                "Feedback is shown to the applicants: address each submitter by name, "
+                "never by their S label or as submission A or B.")
 
-    def _make_api_call_with_retry(self, content: List[Dict], max_retries: int = 3) -> Dict:
+    def _make_api_call_with_retry(self, content: List[Dict], max_tokens: Optional[int] = None,
+                                  on_winner: Optional[Callable[[str], None]] = None) -> Dict:
+        """
+        Make API call with retry logic. Each attempt waits for a concurrency slot
+        and enough request and token budget first. With on_winner the response is
+        streamed and on_winner gets the verdict as soon as it appears.
+        max_tokens defaults to the pair verdict budget, self.max_output_tokens.
+        """
+        max_tokens = max_tokens or self.max_output_tokens
+        headers = self._api_headers()
+        params = self._message_params(content, max_tokens)
+        if on_winner is not None:
+            params["stream"] = True
+        # Serialize once with orjson; the base64 image data makes stdlib json slow,
+        # and retries resend the same bytes
+        body = orjson.dumps(params)
+        
+        estimated_tokens = self._estimate_tokens(content) + max_tokens
+        timeout = API_BASE_TIMEOUT + max_tokens / API_MIN_OUTPUT_TOKENS_PER_SECOND
+        delay = API_RETRY_BASE_DELAY
+        for attempt in range(API_MAX_RETRIES + 1):
+            try:
+                with self.api_semaphore:
+                    self.request_limiter.acquire()
+                    self.token_limiter.acquire(estimated_tokens)
+                    response = self.session.post(self.api_url, headers=headers, data=body, timeout=timeout,
+                                                 stream=on_winner is not None)
+                    response.raise_for_status()
+                    # Servers that ignore the stream flag answer with plain JSON
+                    streamed = response.headers.get('content-type', '').startswith('text/event-stream')
+                    if on_winner is not None and streamed:
+                        result = self._read_event_stream(response, on_winner)
+                    else:
+                        result = orjson.loads(response.content)
+                
+                if result.get('stop_reason') == 'max_tokens':
+                    print(f"Response hit the {max_tokens}-token output limit and may be truncated")
+                return result
+            except requests.exceptions.RequestException as e:
+                print(f"API call attempt {attempt + 1} failed: {e}")
+                if attempt == API_MAX_RETRIES or not self._is_retryable(e):
+                    raise
+                delay = self._retry_delay(e, delay)
+                time.sleep(delay)
+    
+    def _read_event_stream(self, response: requests.Response, on_winner: Callable[[str], None]) -> Dict:
+        """
+        Accumulate a streamed (server-sent events) Messages response into the shape
+        of a non-streamed one, calling on_winner as soon as the verdict is complete
+        """
+        text_parts = []
+        stop_reason = None
+        winner_found = False
+        for line in response.iter_lines():
+            if not line.startswith(b'data:'):
+                continue
+            event = orjson.loads(line[5:])
+            if event.get('type') == 'content_block_delta':
+                text_parts.append(event['delta'].get('text', ''))
+                if not winner_found:
+                    match = WINNER_FIELD_RE.search(JSON_PREFILL + ''.join(text_parts))
+                    if match:
+                        winner_found = True
+                        on_winner(match.group(1))
+            elif event.get('type') == 'message_delta':
+                stop_reason = event['delta'].get('stop_reason', stop_reason)
+            elif event.get('type') == 'error':
+                raise ValueError(f"Streamed response failed: {event.get('error')}")
+        
+        return {"content": [{"type": "text", "text": ''.join(text_parts)}], "stop_reason": stop_reason}
+    
+    def _api_headers(self) -> Dict:
         """
-        Make API call with retry logic
+        Headers for authenticated Anthropic API requests
         """
-        headers = {
+        return {
             "x-api-key": self.api_key,
             "anthropic-version": "2023-06-01",
+            "anthropic-beta": "prompt-caching-2024-07-31",
             "content-type": "application/json"
         }
-        
-        data = {
+    
+    def _message_params(self, content: List[Dict], max_tokens: Optional[int] = None) -> Dict:
+        """
+        Messages API parameters for an evaluation, asking for a bare JSON answer
+        """
+        return {
             "model": self.model,
-            "max_tokens": 2000,
-            "messages": [{"role": "user", "content": content}]
+            "max_tokens": max_tokens or self.max_output_tokens,
+            "system": JSON_SYSTEM_PROMPT,
+            "messages": [
+                {"role": "user", "content": content},
+                {"role": "assistant", "content": JSON_PREFILL}
+            ]
         }
+    
+    def _is_retryable(self, error: requests.exceptions.RequestException) -> bool:
+        """
+        Retry dropped connections, timeouts and transient HTTP statuses only
+        """
+        response = getattr(error, 'response', None)
+        if response is None:
+            return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+        return response.status_code in API_RETRY_STATUSES
+    
+    def _retry_delay(self, error: requests.exceptions.RequestException, previous_delay: float) -> float:
+        """
+        Compute the next backoff delay, honoring the server's Retry-After header
+        when present and otherwise using decorrelated jitter
+        """
+        response = getattr(error, 'response', None)
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    # A little jitter keeps concurrent workers from retrying in lock-step
+                    return float(retry_after) + random.random()
+                except ValueError:
+                    pass  # HTTP-date form, fall back to jittered backoff
         
-        for attempt in range(max_retries):
-            try:
-                response = requests.post(self.api_url, headers=headers, json=data, timeout=30)
-                response.raise_for_status()
-                return response.json()
-            except requests.exceptions.RequestException as e:
-                print(f"API call attempt {attempt + 1} failed: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)  # Exponential backoff
-                else:
-                    raise
+        return min(API_RETRY_MAX_DELAY, random.uniform(API_RETRY_BASE_DELAY, previous_delay * 3))
+    
+    def _estimate_tokens(self, content: List[Dict]) -> int:
+        """
+        Estimate the input tokens of a message: ~4 characters per text token plus
+        a fixed cost per image
+        """
+        tokens = len(JSON_SYSTEM_PROMPT) // 4
+        for block in content:
+            if block.get('type') == 'image':
+                tokens += IMAGE_TOKEN_ESTIMATE
+            else:
+                tokens += len(block.get('text', '')) // 4
+        return tokens
     
-    def _parse_evaluation_response(self, response: Dict, name_a: str, name_b: str) -> Dict:
+    def _parse_evaluation_response(self, response: Dict, name_a: str, name_b: str) -> Tuple[Optional[Dict], bool]:
         """
-        Parse Claude's response into expected format
+        Parse Claude's response into expected format. Returns (evaluation, complete):
+        evaluation is None if the response can't be parsed, so callers fall back
+        without caching a made-up verdict, and complete is False when the feedback
+        had to be pieced together from plain or cut-off text, so it isn't cached either.
         """
         try:
-            content = response.get('content', [{}])[0].get('text', '')
+            content = self._response_text(response)
             
             # Try to extract JSON from response
-            start_idx = content.find('{')
-            end_idx = content.rfind('}') + 1
+            try:
+                evaluation = self._extract_json(content)
+            except ValueError:
+                # Cut-off JSON still carries the verdict, which is written first
+                match = WINNER_FIELD_RE.search(content)
+                if match is None:
+                    raise
+                return {**self._extract_evaluation_from_text(content, name_a, name_b), 'winner': match.group(1)}, False
             
-            if start_idx != -1 and end_idx != -1:
-                json_str = content[start_idx:end_idx]
-                evaluation = json.loads(json_str)
-                
+            if evaluation is not None:
                 # Validate required fields
                 required_fields = ['winner', 'feedback_a', 'feedback_b', 'pros_cons_a', 'pros_cons_b']
                 if all(field in evaluation for field in required_fields):
-                    return evaluation
+                    return evaluation, True
             
             # If parsing fails, create structured response from text
-            return self._extract_evaluation_from_text(content, name_a, name_b)
+            return self._extract_evaluation_from_text(content, name_a, name_b), False
             
         except Exception as e:
             print(f"Error parsing evaluation response: {e}")
-            return self._fallback_evaluation(name_a, name_b)
+            return None, False
+    
+    def _parse_group_response(self, response: Dict, names: List[str],
+                              pairs: List[Tuple[int, int]]) -> Dict[Tuple[int, int], Dict]:
+        """
+        Parse Claude's group response into per-pair evaluations
+        """
+        results = {}
+        try:
+            evaluation = self._extract_json(self._response_text(response))
+            if evaluation is None:
+                return results
+            
+            submissions = evaluation.get('submissions', {})
+            
+            for comparison in evaluation.get('comparisons', []):
+                try:
+                    i = int(str(comparison['a']).lstrip('S')) - 1
+                    j = int(str(comparison['b']).lstrip('S')) - 1
+                except (KeyError, ValueError):
+                    continue
+                
+                winner = comparison.get('winner')
+                if (i, j) not in pairs and (j, i) in pairs:
+                    # Claude listed the pair the other way round
+                    i, j = j, i
+                    winner = {'A': 'B', 'B': 'A'}.get(winner)
+                
+                sub_a = submissions.get(f"S{i + 1}")
+                sub_b = submissions.get(f"S{j + 1}")
+                if (i, j) not in pairs or winner not in ('A', 'B') or not sub_a or not sub_b:
+                    continue
+                
+                results[(i, j)] = {
+                    'winner': winner,
+                    'feedback_a': sub_a.get('feedback', ''),
+                    'feedback_b': sub_b.get('feedback', ''),
+                    'pros_cons_a': sub_a.get('pros_cons', {'pros': [], 'cons': []}),
+                    'pros_cons_b': sub_b.get('pros_cons', {'pros': [], 'cons': []})
+                }
+            
+        except Exception as e:
+            print(f"Error parsing group evaluation response: {e}")
+        
+        return results
+    
+    def _response_text(self, response: Dict) -> str:
+        """
+        Return the response text with the prefilled opening brace restored
+        """
+        return JSON_PREFILL + response.get('content', [{}])[0].get('text', '')
+    
+    def _extract_json(self, content: str):
+        """
+        Decode the first JSON object in content, ignoring any prose after it.
+        Returns None if there is no object to decode.
+        """
+        # With the prefilled brace the answer is usually exactly one JSON object
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass
+        
+        # Otherwise decode from the first brace and stop at the end of that object
+        start_idx = content.find('{')
+        if start_idx == -1:
+            return None
+        evaluation, _ = json.JSONDecoder().raw_decode(content, start_idx)
+        return evaluation
     
     def _extract_evaluation_from_text(self, text: str, name_a: str, name_b: str) -> Dict:
         """
         Extract evaluation from unstructured text response
         """
-        # Simple heuristic to determine winner
-        winner = 'A' if name_a.lower() in text.lower() and 'better' in text.lower() else 'B'
+        # Simple heuristic to determine winner: the name mentioned just before "better"
+        match = _winner_pattern(name_a, name_b).search(text)
+        winner = 'A' if match and match.group(1).lower() == name_a.lower() else 'B'
         
         return {
             'winner': winner,
@@ -272,10 +1010,11 @@ Remember: Be generous with poor screenshots, focus on technical implementation e
     
     def _fallback_evaluation(self, name_a: str, name_b: str) -> Dict:
         """
-        Fallback evaluation if API fails
+        Fallback evaluation if API fails. The winner is derived from a stable
+        hash of the names, so the same pair always falls back the same way.
         """
-        import random
-        winner = 'A' if random.random() > 0.5 else 'B'
+        digest = hashlib.blake2b(f"{name_a}\0{name_b}".encode('utf-8'), digest_size=1).digest()
+        winner = 'A' if digest[0] & 1 else 'B'
         
         return {
             'winner': winner,